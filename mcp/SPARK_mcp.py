@@ -1,8 +1,3 @@
-# Fix multiprocessing deadlock in asyncio context
-# Must be called before any other imports
-import multiprocessing
-multiprocessing.set_start_method("spawn", force=True)
-
 """
 Model Context Protocol (MCP) for SPARK
 
@@ -11,32 +6,47 @@ patterns in spatially resolved transcriptomic data using generalized linear spat
 This package enables identification of spatially variable genes in tissue samples.
 
 This MCP Server provides Python interfaces to R tools extracted from the following tutorial files:
-1. 02_spark_example (Example Analysis with SPARK: Breast Cancer Data)
+1. 02_spark_example, in tools/spark_example.py (Example Analysis with SPARK: Breast Cancer Data)
     - create_spark_object: Create SPARK object from count matrix and spatial coordinates (calls R via Rscript)
     - spark_vc: Estimate SPARK model parameters under null hypothesis (calls R via Rscript)
     - spark_test: Test genes for spatial expression patterns (calls R via Rscript)
+    - spark_test_batch: Test several fitted SPARK objects in a single R call
+    - spark_pipeline: Run create_spark_object, spark_vc and spark_test in a single R call
+    - clear_cache: Delete SPARK object files written by the server
 
-Note: All tools execute R code via Rscript subprocess calls. Ensure R is installed
-and the package dependencies are available in the renv environment at repo/SPARK/.
+Note: All tools execute R code in a long-lived Rscript worker (r_scripts/02_spark_example/worker.R)
+that keeps SPARK loaded between calls. Ensure R is installed and the package dependencies are
+available in the renv environment at repo/SPARK/.
 """
 
 from mcp.server.fastmcp import FastMCP
-import importlib
+from tools import spark_example as spark_example_02
 
-# Import statements (using importlib for numeric-prefixed modules)
-spark_example_02 = importlib.import_module('tools.02_spark_example')
+# The server does not use Python multiprocessing: parallel work runs in the pooled
+# R worker processes (spark_vc fits gene batches on several of them), so the start
+# method is left alone.
 
 # Server definition
 mcp = FastMCP(name="SPARK")
 
-# Register tools from 02_spark_example module
+# Register tools from 02_spark_example module (the module defines plain functions;
+# add_tool takes each description from its docstring)
 create_spark_object = spark_example_02.create_spark_object
 spark_vc = spark_example_02.spark_vc
 spark_test = spark_example_02.spark_test
+spark_test_batch = spark_example_02.spark_test_batch
+spark_pipeline = spark_example_02.spark_pipeline
+clear_cache = spark_example_02.clear_cache
 
 mcp.add_tool(create_spark_object)
 mcp.add_tool(spark_vc)
 mcp.add_tool(spark_test)
+mcp.add_tool(spark_test_batch)
+mcp.add_tool(spark_pipeline)
+mcp.add_tool(clear_cache)
+
+# Start an R worker now so SPARK is already loaded when the first tool is called
+spark_example_02.warm_up()
 
 if __name__ == "__main__":
     mcp.run()
@@ -0,0 +1,61 @@
+"""Summaries of spark_test result CSVs (python -m unittest discover mcp/tests)."""
+
+import math
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from tools import spark_example
+
+
+class SummarizeResultsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.csv = Path(self.tmp.name) / "results.csv"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def summarize(self, rows):
+        """Summary of a results CSV with the given (gene, adjusted p-value) rows, as fwrite writes them."""
+        with open(self.csv, "w") as f:
+            f.write("gene,combined_pvalue,adjusted_pvalue\n")
+            for gene, pvalue in rows:
+                f.write(f"{gene},{pvalue},{pvalue}\n")
+        return spark_example._summarize_results(str(self.csv))
+
+    def test_preview_is_stable_on_ties(self):
+        rows = [(f"g{i}", p) for i, p in enumerate([0.5, 0.01, 0.2, 0.01, 0.3, 0.01, 0.04, 0.2, 0.9, 0.01, 0.2, 0.6])]
+        summary = self.summarize(rows)
+        # Ordered by p-value, then by row, like heapq.nsmallest on the rows
+        expected = ["g1", "g3", "g5", "g9", "g6", "g2", "g7", "g10", "g4", "g0"]
+        self.assertEqual([gene["gene"] for gene in summary["results_preview"]], expected)
+        self.assertEqual(summary["n_genes_tested"], 12)
+        self.assertEqual(summary["n_significant_genes"], 5)
+
+    def test_missing_pvalues_are_counted_but_not_previewed(self):
+        summary = self.summarize([("g0", "NA"), ("g1", 0.03), ("g2", ""), ("g3", 0.5)])
+        self.assertEqual([gene["gene"] for gene in summary["results_preview"]], ["g1", "g3"])
+        self.assertEqual(summary["n_genes_tested"], 4)
+        self.assertEqual(summary["n_significant_genes"], 1)
+        self.assertTrue(math.isnan(spark_example._pvalue("")))
+
+    def test_fewer_rows_than_preview(self):
+        summary = self.summarize([("g0", 0.2), ("g1", 0.1)])
+        self.assertEqual(summary["results_preview"], [
+            {"gene": "g1", "combined_pvalue": 0.1, "adjusted_pvalue": 0.1},
+            {"gene": "g0", "combined_pvalue": 0.2, "adjusted_pvalue": 0.2},
+        ])
+
+    def test_no_rows(self):
+        summary = self.summarize([])
+        self.assertEqual((summary["n_genes_tested"], summary["n_significant_genes"], summary["results_preview"]),
+                         (0, 0, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
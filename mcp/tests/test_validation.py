@@ -0,0 +1,63 @@
+"""Input checks that run before any R work (python -m unittest discover mcp/tests)."""
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from tools import spark_example
+
+
+class ValidateCountsLocationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_inputs(self, n_spots: int, n_genes: int = 50, row_names_header: bool = True):
+        """Counts and location CSVs; without ``row_names_header`` the headers
+        leave out the row-name column, as R's write.csv does."""
+        spots = [f"AAACAAGTATCTCCCA-{i}" for i in range(n_spots)]
+        counts = self.dir / "counts.csv"
+        with open(counts, "w") as f:
+            f.write(",".join(["gene", *spots] if row_names_header else spots) + "\n")
+            for g in range(n_genes):
+                f.write(",".join([f"gene{g}", *(str((g + i) % 3) for i in range(n_spots))]) + "\n")
+        location = self.dir / "location.csv"
+        with open(location, "w") as f:
+            f.write("spot,x,y\n" if row_names_header else "x,y\n")
+            for i, spot in enumerate(spots):
+                f.write(f"{spot},{i % 100},{i // 100}\n")
+        return str(counts), str(location)
+
+    def test_header_wider_than_first_block(self):
+        counts, location = self.write_inputs(5000)
+        self.assertGreater(len(Path(counts).read_bytes().split(b"\n")[0]), 65536)
+        spark_example._validate_counts_location(counts, location)
+
+    def test_header_without_row_names_column(self):
+        counts, location = self.write_inputs(20, row_names_header=False)
+        spark_example._validate_counts_location(counts, location)
+        self.assertEqual(spark_example._validate_csv(counts), 21)
+
+    def test_non_numeric_column_named_from_short_header(self):
+        covariates = self.dir / "covariates.csv"
+        covariates.write_text("batch,depth\ns1,a,1.5\ns2,b,2.5\n")
+        with self.assertRaisesRegex(ValueError, "non-numeric columns: batch"):
+            spark_example._validate_csv(str(covariates), numeric=True)
+
+    def test_location_rows_must_match_spots(self):
+        counts, location = self.write_inputs(20)
+        with open(location, "a") as f:
+            f.write("extra,1,1\n")
+        with self.assertRaises(ValueError):
+            spark_example._validate_counts_location(counts, location)
+
+
+if __name__ == "__main__":
+    unittest.main()
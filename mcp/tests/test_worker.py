@@ -0,0 +1,42 @@
+"""Reading the R worker's replies (python -m unittest discover mcp/tests)."""
+
+import io
+import sys
+import types
+import unittest
+from contextlib import redirect_stderr
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from tools import spark_example
+
+
+class ReadReplyTest(unittest.TestCase):
+
+    def read_reply(self, output: str):
+        """Reply parsed from the given worker stdout, and what was forwarded to stderr."""
+        session = spark_example._RSession()
+        session._proc = types.SimpleNamespace(stdout=io.StringIO(output))
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            reply = session._read_reply()
+        return reply, stderr.getvalue()
+
+    def test_tag_after_output_without_newline(self):
+        reply, stderr = self.read_reply('progress 50%###RESULT###{"ok": true}\n')
+        self.assertEqual(reply, {"ok": True})
+        self.assertEqual(stderr, "progress 50%\n")
+
+    def test_other_lines_go_to_stderr(self):
+        reply, stderr = self.read_reply('Loading SPARK\n###RESULT###{"ok": true, "result": {"n": 1}}\n')
+        self.assertEqual(reply, {"ok": True, "result": {"n": 1}})
+        self.assertEqual(stderr, "Loading SPARK\n")
+
+    def test_worker_exit_without_reply(self):
+        with self.assertRaises(RuntimeError):
+            self.read_reply("partial output\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,930 @@
+"""MCP tools for SPARK - Spatial Pattern Recognition via Kernels
+
+SPARK detects genes with spatial expression patterns in spatially resolved
+transcriptomic data using generalized linear spatial models.
+"""
+
+import asyncio
+import atexit
+import csv
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Annotated, Optional
+from uuid import uuid4
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+
+# Point to the R scripts directory for this tutorial
+R_SCRIPT_DIR = Path(__file__).parent.parent / "r_scripts" / "02_spark_example"
+
+# Marks the single reply worker.R writes for each request; it starts a line
+# unless R printed something without a trailing newline just before it
+_RESULT_TAG = "###RESULT###"
+
+# Outputs of create_spark_object and spark_vc, keyed by a hash of their inputs.
+# Set SPARK_MCP_NO_CACHE=1 to always recompute. Least recently used entries
+# are removed once the cache grows past SPARK_MCP_CACHE_GB gigabytes.
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "spark_mcp"
+_MAX_CACHE_BYTES = int(float(os.environ.get("SPARK_MCP_CACHE_GB", 10)) * 2**30)
+# Partial files (*.tmp) and results without a JSON entry that have not been
+# written to for this long are left over from interrupted calls
+_STALE_SECONDS = 3600
+
+# Uncached outputs live in a per-session directory that is removed on exit.
+# Only the most recent _MAX_SESSION_FILES are kept; older ones are deleted.
+_SESSION_TMP = Path(tempfile.mkdtemp(prefix="spark_mcp_"))
+atexit.register(shutil.rmtree, _SESSION_TMP, ignore_errors=True)
+_MAX_SESSION_FILES = 32
+_session_files: OrderedDict = OrderedDict()
+
+# Upper bound on concurrently running R workers
+_MAX_WORKERS = int(os.environ.get("SPARK_MCP_R_WORKERS", 4))
+
+# Parallelism comes from running several workers (and SPARK's num_core), so
+# each worker's BLAS/OpenMP is single-threaded unless the user says otherwise
+_WORKER_ENV = {
+    "OMP_NUM_THREADS": "1",
+    "OPENBLAS_NUM_THREADS": "1",
+    "MKL_NUM_THREADS": "1",
+    **os.environ,
+}
+
+# How many object paths the pool remembers the last worker for
+_MAX_OWNED_OBJECTS = 64
+
+
+class _RSession:
+    """Long-lived ``Rscript worker.R`` process with SPARK already loaded.
+
+    Each request is one JSON line on the worker's stdin and is answered by one
+    line starting with ``_RESULT_TAG`` on its stdout. Anything else R prints
+    there is passed through to stderr so it never reaches the MCP stdio
+    channel. Calls are serialized on a lock; the worker is started on first
+    use and restarted if it dies.
+    """
+
+    def __init__(self):
+        self._proc = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Spawn the worker process without waiting for SPARK to load."""
+        self._proc = subprocess.Popen(
+            ["Rscript", str(R_SCRIPT_DIR / "worker.R")],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+            # Python's own descriptors are non-inheritable (PEP 446), so the
+            # close-all-fds pass before exec is not needed
+            close_fds=False,
+            # Keep terminal signals (Ctrl-C) away from the worker; atexit stops it
+            start_new_session=True,
+            env=_WORKER_ENV,
+        )
+        self._ready = False
+
+    def run(self, script: str, args: dict) -> dict:
+        """Run ``script`` from R_SCRIPT_DIR in the worker with the given arguments."""
+        with self._lock:
+            if self._proc is None or self._proc.poll() is not None:
+                self.start()
+            if not self._ready:
+                self._wait_ready()
+            request = {"script": str(R_SCRIPT_DIR / script), "args": args}
+            try:
+                # R's fromJSON rejects the NaN/Infinity that json.dumps writes by default
+                self._proc.stdin.write(json.dumps(request, allow_nan=False) + "\n")
+                self._proc.stdin.flush()
+                reply = self._read_reply()
+            except (BrokenPipeError, RuntimeError):
+                self.close()
+                raise RuntimeError(f"R worker died while running {script}")
+        if not reply["ok"]:
+            raise RuntimeError(f"{script} failed: {reply['error']}")
+        return reply
+
+    def close(self):
+        """Terminate the worker process, if one is running."""
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc.wait()
+            self._proc = None
+
+    def _wait_ready(self):
+        # The worker sends one reply once SPARK is loaded
+        try:
+            self._read_reply()
+        except RuntimeError:
+            self.close()
+            raise RuntimeError("R worker failed to start; check that SPARK is installed")
+        self._ready = True
+
+    def _read_reply(self) -> dict:
+        for line in self._proc.stdout:
+            # R output without a trailing newline (cat(), progress bars) ends
+            # up in front of the tag on the same line
+            start = line.find(_RESULT_TAG)
+            if start >= 0:
+                if start > 0:
+                    sys.stderr.write(line[:start] + "\n")
+                return json.loads(line[start + len(_RESULT_TAG):])
+            sys.stderr.write(line)
+        raise RuntimeError("R worker exited")
+
+
+class _RSessionPool:
+    """Hands out idle R workers, starting new ones up to ``size``.
+
+    Workers keep the SPARK objects they last read or wrote in memory (see
+    worker.R), so the pool remembers which worker touched each object path
+    and prefers that worker, when idle, for later calls on the same object.
+
+    ``run`` blocks until a worker is free, so it is meant to be called from a
+    thread (see ``_run_r``) rather than on the event loop.
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+        self._sessions = []
+        self._idle = []
+        self._owners = OrderedDict()
+        self._cond = threading.Condition()
+
+    def run(self, script: str, args: dict, objects: tuple = ()) -> dict:
+        """Run ``script``; ``objects`` are the RDS paths it reads or writes."""
+        objects = [os.path.realpath(path) for path in objects]
+        session = self._acquire(objects)
+        try:
+            return session.run(script, args)
+        finally:
+            self._release(session, objects)
+
+    def warm_up(self):
+        """Start a first worker now so SPARK loads before any call needs it.
+
+        If R cannot be started, this only logs to stderr; the error is
+        raised again by the first tool call.
+        """
+        with self._cond:
+            if not self._sessions:
+                session = _RSession()
+                try:
+                    session.start()
+                except OSError as e:
+                    sys.stderr.write(f"Could not start R worker: {e}\n")
+                    return
+                self._sessions.append(session)
+                self._idle.append(session)
+
+    def close(self):
+        """Terminate all workers."""
+        for session in self._sessions:
+            session.close()
+
+    def _acquire(self, objects: list[str]) -> _RSession:
+        with self._cond:
+            while not self._idle and len(self._sessions) >= self._size:
+                self._cond.wait()
+            for path in objects:
+                owner = self._owners.get(path)
+                if owner in self._idle:
+                    self._idle.remove(owner)
+                    return owner
+            if self._idle:
+                return self._idle.pop()
+            session = _RSession()
+            self._sessions.append(session)
+            return session
+
+    def _release(self, session: _RSession, objects: list[str]):
+        with self._cond:
+            for path in objects:
+                self._owners[path] = session
+                self._owners.move_to_end(path)
+            while len(self._owners) > _MAX_OWNED_OBJECTS:
+                self._owners.popitem(last=False)
+            self._idle.append(session)
+            self._cond.notify()
+
+
+_POOL = _RSessionPool(_MAX_WORKERS)
+atexit.register(_POOL.close)
+
+
+def warm_up():
+    """Start an R worker in the background so the first tool call does not wait for SPARK to load."""
+    _POOL.warm_up()
+
+
+async def _run_r(script: str, args: dict, objects: tuple = ()) -> dict:
+    """Run an R script on a pooled worker without blocking the event loop.
+
+    ``objects`` lists the SPARK object RDS paths the script reads or writes,
+    so it can be routed to the worker that already holds them in memory.
+    """
+    return await asyncio.to_thread(_POOL.run, script, args, objects)
+
+
+def _file_digest(path) -> str:
+    """BLAKE2b of a file, hashed straight from a memory map without copying it."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            digest.update(mm)
+    return digest.hexdigest()
+
+
+def _cache_key(file_paths: list, params: dict) -> Optional[str]:
+    """Hash input file contents and parameters; None when caching is disabled."""
+    if os.environ.get("SPARK_MCP_NO_CACHE") == "1":
+        return None
+    key = hashlib.blake2b(digest_size=16)
+    for path in file_paths:
+        key.update(_file_digest(path).encode())
+    key.update(json.dumps(params, sort_keys=True).encode())
+    return key.hexdigest()
+
+
+def _cache_get(key: Optional[str]) -> Optional[dict]:
+    """Return the stored result for ``key`` if both it and its RDS still exist."""
+    if key is None:
+        return None
+    result_json = CACHE_DIR / f"{key}.json"
+    if not (result_json.exists() and (CACHE_DIR / f"{key}.rds").exists()):
+        return None
+    # The result file's mtime records the last use, for _prune_cache
+    result_json.touch()
+    return json.loads(result_json.read_text())
+
+
+def _cache_put(key: Optional[str], result: dict) -> dict:
+    """Store ``result`` under ``key`` (a no-op when caching is disabled).
+
+    The result is written to a temporary file and renamed into place, like
+    the RDS itself (see worker.R), so concurrent identical calls never leave
+    a partial entry.
+    """
+    if key is not None:
+        partial = CACHE_DIR / f"{key}.{uuid4().hex}.tmp"
+        partial.write_text(json.dumps(result))
+        os.replace(partial, CACHE_DIR / f"{key}.json")
+        _prune_cache(keep=key)
+    return result
+
+
+def _remove_stale_files():
+    """Delete cache files left behind by interrupted writes (see _STALE_SECONDS)."""
+    cutoff = time.time() - _STALE_SECONDS
+    for path in CACHE_DIR.iterdir():
+        orphan = path.suffix == ".tmp" or (path.suffix == ".rds" and not path.with_suffix(".json").exists())
+        try:
+            if orphan and path.stat().st_mtime < cutoff:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _prune_cache(keep: str):
+    """Remove least recently used cache entries, other than ``keep``, beyond _MAX_CACHE_BYTES."""
+    _remove_stale_files()
+    entries = []
+    total = 0
+    for result_json in CACHE_DIR.glob("*.json"):
+        rds = result_json.with_suffix(".rds")
+        try:
+            last_used = result_json.stat().st_mtime
+            size = result_json.stat().st_size + (rds.stat().st_size if rds.exists() else 0)
+        except FileNotFoundError:
+            continue
+        entries.append((last_used, result_json, rds, size))
+        total += size
+    for _, result_json, rds, size in sorted(entries, key=lambda entry: entry[0]):
+        if total <= _MAX_CACHE_BYTES:
+            break
+        if result_json.stem == keep:
+            continue
+        result_json.unlink(missing_ok=True)
+        rds.unlink(missing_ok=True)
+        total -= size
+
+
+def _session_paths(suffix: str, n: int) -> list[str]:
+    """``n`` new output paths in the session directory, evicting the oldest beyond the limit.
+
+    The new paths are never evicted by their own reservation, so a batch
+    larger than _MAX_SESSION_FILES keeps all its outputs until the next call.
+    """
+    paths = [str(_SESSION_TMP / f"{uuid4().hex}{suffix}") for _ in range(n)]
+    for path in paths:
+        _session_files[path] = None
+    while len(_session_files) > max(_MAX_SESSION_FILES, n):
+        oldest, _ = _session_files.popitem(last=False)
+        Path(oldest).unlink(missing_ok=True)
+    return paths
+
+
+def _session_path(suffix: str) -> str:
+    """New output path in the session directory, evicting the oldest beyond the limit."""
+    return _session_paths(suffix, 1)[0]
+
+
+def _touch(path: str):
+    """Mark a session output as recently used so it is evicted last."""
+    if path in _session_files:
+        _session_files.move_to_end(path)
+
+
+def _check_file(path: str) -> int:
+    """Size of an input file, raising ValueError if it is missing or empty."""
+    try:
+        size = os.stat(path).st_size
+    except OSError as e:
+        raise ValueError(f"Cannot read input file {path}: {e.strerror}") from None
+    if size == 0:
+        raise ValueError(f"Input file {path} is empty")
+    return size
+
+
+def _validate_csv(path: str, min_cols: Optional[int] = None, numeric: bool = False) -> int:
+    """Check an input CSV from its first lines and return its number of columns.
+
+    Only the first 64 KiB are parsed, or the header and first row if they
+    are longer (wide count matrices can have headers of several hundred KiB).
+    As with fread, a header one field shorter than the rows (R's write.csv
+    with row names) leaves the first column unnamed. With ``numeric``, every
+    column after the first (the row names) must hold numbers.
+    """
+    _check_file(path)
+    with open(path, "rb") as f:
+        first, second = f.readline(), f.readline()
+    # The first block has to hold whole lines for the column types to be inferred
+    block_size = max(65536, 2 * (len(first) + len(second)))
+    header, *rows = csv.reader(line.decode("utf-8", "replace") for line in (first, second) if line)
+    short_header = bool(rows) and len(header) == len(rows[0]) - 1
+    read_options = pa_csv.ReadOptions(
+        block_size=block_size, skip_rows=int(short_header), autogenerate_column_names=short_header
+    )
+    try:
+        schema = pa_csv.open_csv(path, read_options=read_options).schema
+    except pa.ArrowInvalid as e:
+        raise ValueError(f"Cannot parse {path} as CSV: {e}") from None
+    names = ["", *header] if short_header else schema.names
+    if min_cols is not None and len(schema) < min_cols:
+        raise ValueError(f"{path} has {len(schema)} columns, expected at least {min_cols}")
+    if numeric:
+        non_numeric = [
+            name for name, field in zip(names[1:], list(schema)[1:])
+            if not (pa.types.is_integer(field.type) or pa.types.is_floating(field.type) or pa.types.is_null(field.type))
+        ]
+        if non_numeric:
+            raise ValueError(f"{path} has non-numeric columns: {', '.join(non_numeric[:5])}")
+    return len(schema)
+
+
+def _count_lines(path: str) -> int:
+    """Number of lines in a non-empty file, counted over a memory map in 4 MiB slices."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        n_newlines = sum(mm[i:i + (1 << 22)].count(b"\n") for i in range(0, len(mm), 1 << 22))
+        return n_newlines + (mm[-1:] != b"\n")
+
+
+def _validate_covariates(covariates: list[list[float]]):
+    """Check an in-memory covariates matrix: non-empty, rectangular and finite."""
+    if not covariates or not covariates[0]:
+        raise ValueError("covariates is empty")
+    n_cols = len(covariates[0])
+    for i, row in enumerate(covariates):
+        if len(row) != n_cols:
+            raise ValueError(f"covariates row {i} has {len(row)} values, expected {n_cols}")
+        if not all(math.isfinite(value) for value in row):
+            raise ValueError(f"covariates row {i} has a missing or infinite value")
+
+
+def _mtx_dims(path: str) -> tuple[int, int]:
+    """Number of rows and columns of a MatrixMarket file, read from its size line."""
+    _check_file(path)
+    with open(path, "rb") as f:
+        if not f.readline().startswith(b"%%MatrixMarket"):
+            raise ValueError(f"{path} is not a MatrixMarket file")
+        for line in f:
+            if line.startswith(b"%") or not line.strip():
+                continue
+            try:
+                n_rows, n_cols = (int(field) for field in line.split()[:2])
+            except ValueError:
+                break
+            return n_rows, n_cols
+    raise ValueError(f"{path} has no valid MatrixMarket size line")
+
+
+def _validate_counts_location(counts_csv: Optional[str], location_csv: Optional[str],
+                              n_spots: Optional[int] = None):
+    """Check the count matrix and location CSVs before any R work is started.
+
+    Either may be None when that input is given in another format; the
+    location rows are only compared with the count matrix spots when the
+    spot count is known, from a counts CSV or passed in as ``n_spots``.
+    """
+    if counts_csv:
+        n_spots = _validate_csv(counts_csv, min_cols=2, numeric=True) - 1
+    if location_csv:
+        _validate_csv(location_csv, min_cols=3, numeric=True)
+        if n_spots is not None:
+            # The location file may or may not have a header line
+            n_rows = _count_lines(location_csv)
+            if n_rows not in (n_spots, n_spots + 1):
+                raise ValueError(
+                    f"{location_csv} has {n_rows} rows but the count matrix has {n_spots} spots"
+                )
+
+
+async def _spark_vc_in_batches(args: dict, num_core: int, output_rds: str) -> dict:
+    """Fit spark_vc on gene batches in up to ``num_core`` R workers and merge the fits.
+
+    SPARK's own num_core forks the whole R session once per core; here each
+    worker fits its batch single-threaded and only the per-gene fits are
+    combined by spark_vc_merge.R. Returns the merge script's summary.
+    """
+    spark_object_rds = args["spark_object"]
+    dims = (await _run_r("spark_dims.R", {"spark_object": spark_object_rds}, (spark_object_rds,)))["result"]
+    n_genes = int(dims["n_genes"])
+    # A few more batches than workers evens out genes that are slow to fit
+    batch_size = max(1, n_genes // (num_core + 2))
+    batches = [(first, min(first + batch_size - 1, n_genes)) for first in range(1, n_genes + 1, batch_size)]
+    parts = [str(_SESSION_TMP / f"{uuid4().hex}.rds") for _ in batches]
+    limit = asyncio.Semaphore(num_core)
+
+    async def fit(batch, part):
+        async with limit:
+            await _run_r("spark_vc.R", {
+                **args,
+                "num_core": 1,
+                "gene_from": batch[0],
+                "gene_to": batch[1],
+                "output": part,
+            }, (spark_object_rds,))
+
+    try:
+        await asyncio.gather(*(fit(batch, part) for batch, part in zip(batches, parts)))
+        return (await _run_r("spark_vc_merge.R", {
+            "spark_object": spark_object_rds,
+            "parts": parts,
+            "num_core": num_core,
+            "output": output_rds,
+        }, (spark_object_rds, output_rds)))["result"]
+    finally:
+        for part in parts:
+            Path(part).unlink(missing_ok=True)
+
+
+def _pvalue(value: str) -> float:
+    """Parse a p-value from an R-written CSV, where NA is written as an empty field."""
+    return float(value) if value not in ("", "NA") else math.nan
+
+
+def _summarize_results(results_csv: str, n_preview: int = 10) -> dict:
+    """Gene counts and a preview of the most significant genes from spark_test results.
+
+    Makes a single pass over the CSV without holding it in memory; the
+    preview is kept in a bounded heap.
+    """
+    n_tested = 0
+    n_significant = 0
+    # (-pvalue, -row number, row): the heap top is the worst of the kept rows,
+    # and on ties later rows are dropped first
+    top = []
+    with open(results_csv, newline="") as f:
+        for row in csv.DictReader(f):
+            n_tested += 1
+            pvalue = _pvalue(row["adjusted_pvalue"])
+            # Count significant genes (adjusted p-value < 0.05)
+            if pvalue < 0.05:
+                n_significant += 1
+            if math.isnan(pvalue):
+                continue
+            if len(top) < n_preview:
+                heapq.heappush(top, (-pvalue, -n_tested, row))
+            else:
+                heapq.heappushpop(top, (-pvalue, -n_tested, row))
+    top_genes = [row for _, _, row in sorted(top, reverse=True)]
+
+    return {
+        "n_genes_tested": n_tested,
+        "n_significant_genes": n_significant,
+        "results_preview": [
+            {
+                "gene": row["gene"],
+                "combined_pvalue": _pvalue(row["combined_pvalue"]),
+                "adjusted_pvalue": _pvalue(row["adjusted_pvalue"]),
+            }
+            for row in top_genes
+        ],
+    }
+
+
+async def _test_result(tested_spark_rds: str, output_csv: str) -> dict:
+    """Tool result for one tested SPARK object; removes the results CSV once summarized."""
+    results = await asyncio.to_thread(_summarize_results, output_csv)
+    Path(output_csv).unlink()
+
+    return {
+        "message": f"Spatial pattern testing completed. Found {results['n_significant_genes']} significant genes (FDR < 0.05).",
+        "reference": "https://github.com/xzhoulab/SPARK/blob/master/docs/pages/02_SPARK_Example.md",
+        "tested_spark_object_path": tested_spark_rds,
+        **results,
+    }
+
+
+def _output_rds(key: Optional[str]) -> str:
+    """Where a tool writes its RDS: the cache entry for ``key``, or a session file."""
+    if key is not None:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        return str(CACHE_DIR / f"{key}.rds")
+    return _session_path(".rds")
+
+
+async def create_spark_object(
+    counts_csv: Annotated[Optional[str],
+        "Path to CSV file with expression count matrix (genes × spots). "
+        "First column should be gene names, remaining columns are spot IDs. "
+        "Each cell contains the raw count for that gene in that spot. "
+        "Leave empty (None) when passing counts_arrow or counts_mtx instead."] = None,
+    location_csv: Annotated[Optional[str],
+        "Path to CSV file with spatial coordinates. "
+        "Three columns: spot ID, then x and y coordinates. Row order must match column order in counts_csv. "
+        "Header optional. "
+        "Leave empty (None) when passing location_arrow instead."] = None,
+    percentage: Annotated[float,
+        "Gene filtering threshold: retain genes expressed in at least this fraction of spots. "
+        "Range: 0.0 to 1.0. Default 0.1 means keep genes expressed in ≥10% of spots."] = 0.1,
+    min_total_counts: Annotated[int,
+        "Minimum total counts per spot to retain. Spots with fewer total counts are filtered out. "
+        "Typical value: 10-100 depending on data sparsity."] = 10,
+    seed: Annotated[int,
+        "Random seed for reproducibility. Use same seed to get identical results."] = 42,
+    counts_arrow: Annotated[Optional[str],
+        "Path to a Feather/Arrow IPC file with the count matrix, laid out like counts_csv. "
+        "Much faster to load than CSV for large matrices."] = None,
+    location_arrow: Annotated[Optional[str],
+        "Path to a Feather/Arrow IPC file with the spatial coordinates, laid out like location_csv."] = None,
+    counts_mtx: Annotated[Optional[str],
+        "Path to an uncompressed MatrixMarket (.mtx) file with the count matrix (genes × spots), "
+        "as written by 10x Genomics and Matrix::writeMM. Kept sparse in R, so typical mostly-zero "
+        "spatial data needs a fraction of the memory of CSV. Requires mtx_genes; spot IDs are "
+        "taken from the location file."] = None,
+    mtx_genes: Annotated[Optional[str],
+        "Path to a text file with one gene name per line, in the row order of counts_mtx. "
+        "For tab-separated files such as 10x features.tsv the first column is used."] = None,
+) -> dict:
+    """Create SPARK object from count matrix and spatial coordinates.
+
+    This initializes a SPARK analysis by filtering lowly expressed genes
+    and low-quality spots based on expression thresholds. The SPARK object
+    contains the filtered data and calculated library sizes for normalization.
+    """
+    if sum(path is not None for path in (counts_csv, counts_arrow, counts_mtx)) != 1:
+        raise ValueError("Provide exactly one of counts_csv, counts_arrow or counts_mtx")
+    if (counts_mtx is None) != (mtx_genes is None):
+        raise ValueError("counts_mtx and mtx_genes must be given together")
+    if (location_csv is None) == (location_arrow is None):
+        raise ValueError("Provide exactly one of location_csv or location_arrow")
+
+    n_spots = None
+    if counts_mtx:
+        n_genes, n_spots = await asyncio.to_thread(_mtx_dims, counts_mtx)
+        _check_file(mtx_genes)
+        n_names = await asyncio.to_thread(_count_lines, mtx_genes)
+        if n_names != n_genes:
+            raise ValueError(f"{mtx_genes} has {n_names} lines but {counts_mtx} has {n_genes} genes")
+    await asyncio.to_thread(_validate_counts_location, counts_csv, location_csv, n_spots)
+    for path in (counts_arrow, location_arrow):
+        if path:
+            _check_file(path)
+
+    inputs = [counts_csv or counts_arrow or counts_mtx, location_csv or location_arrow]
+    if mtx_genes:
+        inputs.append(mtx_genes)
+    key = await asyncio.to_thread(
+        _cache_key,
+        [R_SCRIPT_DIR / "create_spark_object.R", *inputs],
+        {"counts_arrow": counts_arrow is not None, "counts_mtx": counts_mtx is not None,
+         "location_arrow": location_arrow is not None,
+         "percentage": percentage, "min_total_counts": min_total_counts, "seed": seed},
+    )
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    output_rds = _output_rds(key)
+
+    summary = (await _run_r("create_spark_object.R", {
+        "counts": counts_csv,
+        "location": location_csv,
+        "counts_feather": counts_arrow,
+        "counts_mtx": counts_mtx,
+        "mtx_genes": mtx_genes,
+        "location_feather": location_arrow,
+        "percentage": percentage,
+        "min_total_counts": min_total_counts,
+        "seed": seed,
+        "output": output_rds,
+    }, (output_rds,)))["result"]
+
+    return _cache_put(key, {
+        "message": f"SPARK object created with {summary['n_genes']} genes and {summary['n_spots']} spots",
+        "reference": "https://github.com/xzhoulab/SPARK/blob/master/docs/pages/02_SPARK_Example.md",
+        "spark_object_path": output_rds,
+        "n_genes": int(summary["n_genes"]),
+        "n_spots": int(summary["n_spots"]),
+        "total_counts": int(summary["total_counts"]),
+    })
+
+
+async def spark_vc(
+    spark_object_rds: Annotated[str,
+        "Path to SPARK object RDS file (from create_spark_object output). "
+        "This object contains the filtered count matrix and spatial coordinates."],
+    covariates_csv: Annotated[Optional[str],
+        "Path to CSV file with covariates matrix (spots × covariates). "
+        "Each row corresponds to a spot, columns are covariates (e.g., batch effects, cell types). "
+        "Leave empty (None) to fit model without covariates."] = None,
+    num_core: Annotated[int,
+        "Number of CPU cores for parallel processing. Higher values speed up computation "
+        "for datasets with many genes. Typical range: 1-8. Genes are fitted in batches on "
+        "separate R workers, so at most SPARK_MCP_R_WORKERS (default 4) run at once."] = 1,
+    verbose: Annotated[bool,
+        "Print detailed progress messages during model fitting. "
+        "Set to True for debugging or monitoring long-running jobs."] = False,
+    seed: Annotated[int,
+        "Random seed for reproducibility. Use same seed to get identical results."] = 42,
+    covariates: Annotated[Optional[list[list[float]]],
+        "Covariates matrix given directly as a list of rows (one row per spot, one value per covariate), "
+        "instead of covariates_csv. Avoids writing a CSV file for programmatically built covariates."] = None,
+) -> dict:
+    """Estimate SPARK model parameters under null hypothesis.
+
+    This function fits a count-based spatial model under the null hypothesis
+    of no spatial pattern. It estimates variance components and prepares the
+    model for hypothesis testing in the next step (spark_test).
+    """
+    _touch(spark_object_rds)
+    _check_file(spark_object_rds)
+
+    if covariates_csv and covariates is not None:
+        raise ValueError("Provide at most one of covariates_csv or covariates")
+    if covariates_csv:
+        await asyncio.to_thread(_validate_csv, covariates_csv)
+    if covariates is not None:
+        _validate_covariates(covariates)
+
+    # verbose does not change the fitted model, so it is not part of the key;
+    # num_core is, since it is stored in the object and used by spark_test
+    input_files = [R_SCRIPT_DIR / "spark_vc.R", spark_object_rds]
+    if covariates_csv:
+        input_files.append(covariates_csv)
+    key = await asyncio.to_thread(
+        _cache_key, input_files,
+        {"covariates": bool(covariates_csv), "covariates_values": covariates, "num_core": num_core, "seed": seed},
+    )
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    output_rds = _output_rds(key)
+
+    args = {
+        "spark_object": spark_object_rds,
+        "covariates": covariates_csv or None,
+        "covariates_matrix": covariates,
+        "verbose": verbose,
+        "seed": seed,
+    }
+
+    if num_core > 1:
+        summary = await _spark_vc_in_batches(args, num_core, output_rds)
+    else:
+        summary = (await _run_r(
+            "spark_vc.R", {**args, "num_core": 1, "output": output_rds}, (spark_object_rds, output_rds)
+        ))["result"]
+
+    return _cache_put(key, {
+        "message": f"Model parameters estimated for {summary['n_genes_fitted']} genes",
+        "reference": "https://github.com/xzhoulab/SPARK/blob/master/docs/pages/02_SPARK_Example.md",
+        "fitted_spark_object_path": output_rds,
+        "n_genes_fitted": int(summary["n_genes_fitted"]),
+        "status": summary["status"],
+    })
+
+
+async def spark_test(
+    fitted_spark_object_rds: Annotated[str,
+        "Path to fitted SPARK object RDS file (from spark_vc output). "
+        "This object contains the estimated model parameters under null hypothesis."],
+    check_positive: Annotated[bool,
+        "Validate that kernel matrices are positive definite. "
+        "Set to True for robust analysis (recommended). False may speed up testing but risks numerical issues."] = True,
+    verbose: Annotated[bool,
+        "Print detailed progress messages during hypothesis testing. "
+        "Shows progress for each gene and kernel tested."] = False,
+    seed: Annotated[int,
+        "Random seed for reproducibility. Use same seed to get identical results."] = 42,
+) -> dict:
+    """Test genes for spatial expression patterns.
+
+    This function performs hypothesis testing to identify genes with significant
+    spatial patterns. It tests multiple kernel functions (Gaussian, Periodic)
+    and combines results. Returns p-values for each gene.
+    """
+    _touch(fitted_spark_object_rds)
+    _check_file(fitted_spark_object_rds)
+
+    # spark_test.R saves the tested object next to the results CSV
+    tested_spark_rds = _session_path(".rds")
+    output_csv = tested_spark_rds.replace(".rds", ".csv")
+
+    await _run_r("spark_test.R", {
+        "spark_object": fitted_spark_object_rds,
+        "check_positive": check_positive,
+        "verbose": verbose,
+        "seed": seed,
+        "output": output_csv,
+    }, (fitted_spark_object_rds, tested_spark_rds))
+
+    return await _test_result(tested_spark_rds, output_csv)
+
+
+async def spark_test_batch(
+    fitted_spark_object_rds_list: Annotated[list[str],
+        "Paths to fitted SPARK object RDS files (from spark_vc output), e.g. one per dataset or seed. "
+        "All objects are tested with the same settings."],
+    check_positive: Annotated[bool,
+        "Validate that kernel matrices are positive definite. "
+        "Set to True for robust analysis (recommended). False may speed up testing but risks numerical issues."] = True,
+    verbose: Annotated[bool,
+        "Print detailed progress messages during hypothesis testing."] = False,
+    seed: Annotated[int,
+        "Random seed for reproducibility. Each object is tested after reseeding with this seed."] = 42,
+) -> list[dict]:
+    """Test several fitted SPARK objects for spatial expression patterns.
+
+    Equivalent to calling spark_test on each object, but all of them are
+    tested in a single R call. Returns one spark_test result per object,
+    in the order given.
+    """
+    if not fitted_spark_object_rds_list:
+        raise ValueError("fitted_spark_object_rds_list is empty")
+    for path in fitted_spark_object_rds_list:
+        _touch(path)
+        _check_file(path)
+
+    # spark_test_batch.R saves each tested object next to its results CSV
+    tested_spark_rds_list = _session_paths(".rds", len(fitted_spark_object_rds_list))
+    output_csvs = [path.replace(".rds", ".csv") for path in tested_spark_rds_list]
+
+    await _run_r("spark_test_batch.R", {
+        "spark_objects": fitted_spark_object_rds_list,
+        "check_positive": check_positive,
+        "verbose": verbose,
+        "seed": seed,
+        "outputs": output_csvs,
+    }, (*fitted_spark_object_rds_list, *tested_spark_rds_list))
+
+    return [
+        await _test_result(tested_spark_rds, output_csv)
+        for tested_spark_rds, output_csv in zip(tested_spark_rds_list, output_csvs)
+    ]
+
+
+async def spark_pipeline(
+    counts_csv: Annotated[str,
+        "Path to CSV file with expression count matrix (genes × spots). "
+        "First column should be gene names, remaining columns are spot IDs."],
+    location_csv: Annotated[str,
+        "Path to CSV file with spatial coordinates. "
+        "Three columns: spot ID, then x and y coordinates. Row order must match column order in counts_csv."],
+    covariates_csv: Annotated[Optional[str],
+        "Path to CSV file with covariates matrix (spots × covariates). "
+        "Leave empty (None) to fit model without covariates."] = None,
+    percentage: Annotated[float,
+        "Gene filtering threshold: retain genes expressed in at least this fraction of spots. "
+        "Range: 0.0 to 1.0."] = 0.1,
+    min_total_counts: Annotated[int,
+        "Minimum total counts per spot to retain."] = 10,
+    check_positive: Annotated[bool,
+        "Validate that kernel matrices are positive definite (recommended)."] = True,
+    num_core: Annotated[int,
+        "Number of CPU cores for model fitting, passed to SPARK's spark.vc, which forks the R "
+        "session once per core. Typical range: 1-8."] = 1,
+    verbose: Annotated[bool,
+        "Print detailed progress messages during fitting and testing."] = False,
+    seed: Annotated[int,
+        "Random seed for reproducibility. Use same seed to get identical results."] = 42,
+) -> dict:
+    """Run the full SPARK analysis: create object, fit null model and test genes.
+
+    Equivalent to calling create_spark_object, spark_vc and spark_test in
+    sequence, but runs as a single R call that keeps the SPARK object in
+    memory between steps instead of writing and re-reading it. Use the
+    individual tools to reuse or inspect intermediate objects.
+
+    Unlike spark_vc, the model fit uses SPARK's own num_core, which copies
+    the whole R session per core; for large datasets with num_core > 1,
+    spark_vc's gene batches need less memory.
+    """
+    await asyncio.to_thread(_validate_counts_location, counts_csv, location_csv)
+    if covariates_csv:
+        await asyncio.to_thread(_validate_csv, covariates_csv)
+
+    # spark_pipeline.R saves the tested object next to the results CSV
+    tested_spark_rds = _session_path(".rds")
+    output_csv = tested_spark_rds.replace(".rds", ".csv")
+
+    summary = (await _run_r("spark_pipeline.R", {
+        "counts": counts_csv,
+        "location": location_csv,
+        "covariates": covariates_csv or None,
+        "percentage": percentage,
+        "min_total_counts": min_total_counts,
+        "check_positive": check_positive,
+        "num_core": num_core,
+        "verbose": verbose,
+        "seed": seed,
+        "output": output_csv,
+    }, (tested_spark_rds,)))["result"]
+
+    results = await asyncio.to_thread(_summarize_results, output_csv)
+    Path(output_csv).unlink()
+
+    return {
+        "message": f"SPARK analysis completed on {summary['n_genes']} genes and {summary['n_spots']} spots. "
+                   f"Found {results['n_significant_genes']} significant genes (FDR < 0.05).",
+        "reference": "https://github.com/xzhoulab/SPARK/blob/master/docs/pages/02_SPARK_Example.md",
+        "tested_spark_object_path": tested_spark_rds,
+        "n_genes": int(summary["n_genes"]),
+        "n_spots": int(summary["n_spots"]),
+        "total_counts": int(summary["total_counts"]),
+        **results,
+    }
+
+
+def _remove_outputs(session_files: list[str]) -> int:
+    """Delete the given session files and all cache entries; returns the number of RDS files removed.
+
+    Partial files of writes still in progress are left alone, so those calls
+    complete; stale ones are removed.
+    """
+    n_removed = 0
+    for path in session_files:
+        if Path(path).exists():
+            Path(path).unlink()
+            n_removed += 1
+    if CACHE_DIR.exists():
+        _remove_stale_files()
+        for path in CACHE_DIR.iterdir():
+            if path.suffix not in (".rds", ".json"):
+                continue
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            if path.suffix == ".rds":
+                n_removed += 1
+    return n_removed
+
+
+async def clear_cache() -> dict:
+    """Delete all SPARK objects written by this server.
+
+    Removes the outputs of this session and every cached result of
+    create_spark_object and spark_vc. Paths returned by earlier tool
+    calls are no longer valid afterwards, and calls still running may
+    fail. Memory is not freed right away: each R worker keeps its most
+    recently used objects until it loads others.
+    """
+    session_files = list(_session_files)
+    _session_files.clear()
+    n_removed = await asyncio.to_thread(_remove_outputs, session_files)
+
+    return {
+        "message": f"Removed {n_removed} SPARK object files",
+        "n_files_removed": n_removed,
+    }